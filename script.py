@@ -7,35 +7,503 @@ Scraper pre ziskanie letakov z webu prospektmaschine.de
 
 import json
 import datetime
+import functools
 import logging
+import multiprocessing
+import os
 import time
 import re
+import sqlite3
+import threading
 
-from typing import List, Dict, Any, Optional
-from urllib.parse import urljoin
-from bs4 import BeautifulSoup
+from collections import deque
+from io import BytesIO
+from logging.handlers import QueueHandler, QueueListener
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+from bs4 import BeautifulSoup, SoupStrainer
+from lxml import etree
 
 import requests
+import requests_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry, make_headers
+
+try:
+    import orjson
+except ImportError:
+    # orjson je volitelny, bez neho sa pouzije standardny json
+    orjson = None
+
+_logger = logging.getLogger(__name__)
+
+# Format datumov: DD.MM.YYYY alebo DD.MM.
+_DATE_FULL = re.compile(r'(\d{2})\.(\d{2})\.(\d{4})')
+_DATE_SHORT = re.compile(r'(\d{2})\.(\d{2})\.')
+_YEAR_RE = re.compile(r'(\d{4})')
+
+# Zo stranky hypermarketov staci postavit strom zoznamu kategorii
+_ONLY_CATEGORIES = SoupStrainer("ul", class_="list-unstyled categories")
+
+def _has_class(name: str) -> str:
+    """XPath podmienka na CSS triedu elementu (ako class_ v BeautifulSoup)"""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+# Predkompilovany XPath vyraz pre stare letaky
+_XP_OLD = etree.XPath(f"boolean(.//div[{_has_class('grid-item-old')}])")
+
+def _iter_brochures(content: bytes) -> Iterator[etree._Element]:
+    """Postupne parsovanie stranky obchodu bez budovania celeho stromu
+    
+    Kazdy letak sa po spracovani uvolni z pamate spolu so svojimi
+    predchadzajucimi surodencami. Rovnako sa uvolni kazdy element mimo letaku,
+    hned ako skonci, takze v strome zostava len rozparsovany letak a cesta
+    k nemu.
+    
+    Args:
+        content: Obsah stranky obchodu v bajtoch
+        
+    Yields:
+        lxml elementy platnych letakov (nie su oznacene ako stare)
+    """
+    # Pocet otvorenych letakov, ich podstrom je potrebny az do konca letaku
+    open_brochures = 0
+    for event, element in etree.iterparse(BytesIO(content), events=("start", "end"), html=True):
+        is_brochure = (element.tag == "div"
+                       and "brochure-thumb" in (element.get("class") or "").split())
+        if event == "start":
+            open_brochures += is_brochure
+            continue
+        if is_brochure:
+            open_brochures -= 1
+            if not _XP_OLD(element):
+                yield element
+        elif open_brochures:
+            continue
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+def _p2(raw: bytes, i: int) -> int:
+    """Dvojciferne cislo z ASCII cislic na pozicii i"""
+    return (raw[i] - 48) * 10 + (raw[i + 1] - 48)
+
+def _unpack_date(text: str) -> Optional[Tuple[int, int, Optional[int]]]:
+    """Rozlozenie datumu v presnom tvare DD.MM.YYYY alebo DD.MM. na cisla bez regexu
+    
+    Args:
+        text: Retazec s jednym datumom
+        
+    Returns:
+        Tuple (den, mesiac, rok alebo None) alebo None ak text nema presny tvar
+    """
+    if len(text) not in (6, 10) or not text.isascii():
+        return None
+    raw = text.encode('ascii')
+    # 46 je ASCII kod bodky
+    if raw[2] != 46 or raw[5] != 46 or not (raw[:2] + raw[3:5] + raw[6:]).isdigit():
+        return None
+    year = _p2(raw, 6) * 100 + _p2(raw, 8) if len(raw) == 10 else None
+    return _p2(raw, 0), _p2(raw, 3), year
+
+def parse_date(date_str: str, current_year: str) -> tuple:
+    """Extrakcia datumov z textu
+    
+    Args:
+        date_str: Retazec obsahujuci datumy
+        current_year: Rok pre datumy bez roku
+        
+    Returns:
+        Tuple (valid_from, valid_to)
+    """
+    try:
+        # Rozdelenie textu na datumy
+        date_from_str, separator, date_to_str = date_str.strip().partition('-')
+        
+        if not separator or '-' in date_to_str:
+            _logger.warning("Neocakavany format datumu: %s", date_str)
+            return None, None
+        
+        # Extrakcia a parsovanie datumov
+        date_from_str = date_from_str.strip()
+        date_to_str = date_to_str.strip()
+        
+        # Rychla cesta: oba datumy v presnom tvare, cislice sa citaju priamo
+        from_parts = _unpack_date(date_from_str)
+        to_parts = _unpack_date(date_to_str)
+        
+        if from_parts and to_parts:
+            from_day, from_month, from_year = from_parts
+            to_day, to_month, to_year = to_parts
+            if from_year is not None and to_year is not None:
+                return (f"{from_year:04d}-{from_month:02d}-{from_day:02d}",
+                        f"{to_year:04d}-{to_month:02d}-{to_day:02d}")
+            if from_year is None and to_year is None:
+                return (f"{current_year}-{from_month:02d}-{from_day:02d}",
+                        f"{current_year}-{to_month:02d}-{to_day:02d}")
+        
+        # Volnejsi text, skusime najprv plny format cez regex
+        from_match_full = _DATE_FULL.search(date_from_str)
+        to_match_full = _DATE_FULL.search(date_to_str)
+        
+        if from_match_full and to_match_full:
+            from_day, from_month, from_year = from_match_full.groups()
+            to_day, to_month, to_year = to_match_full.groups()
+            valid_from = f"{from_year}-{from_month}-{from_day}"
+            valid_to = f"{to_year}-{to_month}-{to_day}"
+            return valid_from, valid_to
+        
+        # Ak plny format nefunguje, skusime kratky format
+        from_match_short = _DATE_SHORT.search(date_from_str)
+        to_match_short = _DATE_SHORT.search(date_to_str)
+        
+        if from_match_short and to_match_short:
+            from_day, from_month = from_match_short.groups()
+            to_day, to_month = to_match_short.groups()
+            # Predpokladame aktualny rok alebo hladame ho v texte
+            year_match = _YEAR_RE.search(date_str)
+            year = year_match.group(1) if year_match else current_year
+            
+            valid_from = f"{year}-{from_month}-{from_day}"
+            valid_to = f"{year}-{to_month}-{to_day}"
+            return valid_from, valid_to
+        
+        _logger.warning("Nepodarilo sa extrahovat datumy z: %s", date_str)
+        return None, None
+    except Exception as e:
+        _logger.error("Chyba pri parsovani datumu %s: %s", date_str, e)
+        return None, None
+
+@functools.lru_cache(maxsize=None)
+def _load_jit_parser():
+    """Oneskorene nacitanie numba a zostavenie jadra na parsovanie datumov
+    
+    numba a numpy su volitelne a importuju sa az pri prvej velkej davke,
+    bez nich sa datumy parsuju po jednom.
+    
+    Returns:
+        Funkcia (riadky, dlzky) -> (ok, has_year, valid_from, valid_to)
+        alebo None, ak numba nie je dostupna
+    """
+    try:
+        import numpy as np
+        from numba import njit, prange
+    except ImportError:
+        return None
+    
+    @njit
+    def number(row, start, count):
+        """Cislo z ASCII cislic v riadku, -1 ak niektory znak nie je cislica"""
+        value = 0
+        for k in range(start, start + count):
+            digit = row[k] - 48
+            if digit < 0 or digit > 9:
+                return -1
+            value = value * 10 + digit
+        return value
+    
+    @njit(parallel=True)
+    def kernel(rows, lengths):
+        """Parsovanie riadkov DD.MM.YYYY-DD.MM.YYYY alebo DD.MM.-DD.MM.
+        
+        Vracia polia ok (riadok ma presny tvar), has_year (plny format)
+        a dve polia YYYYMMDD (MMDD pre kratky format).
+        """
+        count = rows.shape[0]
+        ok = np.zeros(count, dtype=np.bool_)
+        has_year = np.zeros(count, dtype=np.bool_)
+        valid_from = np.zeros(count, dtype=np.int32)
+        valid_to = np.zeros(count, dtype=np.int32)
+        for i in prange(count):
+            row = rows[i]
+            if lengths[i] == 21:
+                # 45 je pomlcka, 46 bodka
+                if (row[2] != 46 or row[5] != 46 or row[10] != 45
+                        or row[13] != 46 or row[16] != 46):
+                    continue
+                from_year = number(row, 6, 4)
+                to_start = 11
+                to_year = number(row, 17, 4)
+            elif lengths[i] == 13:
+                if row[2] != 46 or row[5] != 46 or row[6] != 45 or row[9] != 46 or row[12] != 46:
+                    continue
+                from_year = 0
+                to_start = 7
+                to_year = 0
+            else:
+                continue
+            from_day = number(row, 0, 2)
+            from_month = number(row, 3, 2)
+            to_day = number(row, to_start, 2)
+            to_month = number(row, to_start + 3, 2)
+            if min(from_year, from_month, from_day, to_year, to_month, to_day) < 0:
+                continue
+            ok[i] = True
+            has_year[i] = lengths[i] == 21
+            valid_from[i] = from_year * 10000 + from_month * 100 + from_day
+            valid_to[i] = to_year * 10000 + to_month * 100 + to_day
+        return ok, has_year, valid_from, valid_to
+    
+    def parse(rows: bytes, lengths: List[int]) -> Tuple[list, list, list, list]:
+        """Spustenie jadra nad riadkami dlzky _JIT_ROW spojenymi do bajtov"""
+        grid = np.frombuffer(rows, dtype=np.uint8).reshape(len(lengths), _JIT_ROW)
+        results = kernel(grid, np.array(lengths, dtype=np.int32))
+        return tuple(column.tolist() for column in results)
+    
+    return parse
+
+# Od tohto poctu datumov sa oplati JIT cesta (prevod do numpy a spustenie jadra)
+_JIT_THRESHOLD = 1000
+_JIT_ROW = 21
+
+def parse_dates(date_strs: List[str], current_year: str) -> List[tuple]:
+    """Hromadna extrakcia datumov z textov
+    
+    Od _JIT_THRESHOLD datumov a pri dostupnej numba sa pevne formaty parsuju
+    skompilovanym jadrom, ostatne texty prechadzaju cez parse_date. numba sa
+    importuje az pri prvej takej davke. Scraper vola funkciu pre kazdu stranku
+    obchodu zvlast a tie maju daleko menej letakov, JIT cesta sa preto uplatni
+    len pri priamom volani s velkou davkou.
+    
+    Args:
+        date_strs: Retazce obsahujuce datumy
+        current_year: Rok pre datumy bez roku
+        
+    Returns:
+        Zoznam tuple (valid_from, valid_to) v poradi vstupu
+    """
+    jit_parser = _load_jit_parser() if len(date_strs) >= _JIT_THRESHOLD else None
+    if jit_parser is None:
+        return [parse_date(date_str, current_year) for date_str in date_strs]
+    
+    # Riadky pevnej dlzky doplnene nulami, dlhsie alebo ne-ASCII texty
+    # dostanu dlzku 0 a spracuju sa pomalsou cestou
+    lengths = []
+    encoded = []
+    for date_str in date_strs:
+        date_from_str, separator, date_to_str = date_str.strip().partition('-')
+        raw = f"{date_from_str.strip()}{separator}{date_to_str.strip()}".encode('ascii', 'replace')
+        lengths.append(len(raw) if len(raw) <= _JIT_ROW else 0)
+        encoded.append(raw[:_JIT_ROW].ljust(_JIT_ROW, b'\0'))
+    ok, has_year, valid_from, valid_to = jit_parser(b''.join(encoded), lengths)
+    
+    results = []
+    for date_str, row_ok, row_has_year, date_from, date_to in zip(
+            date_strs, ok, has_year, valid_from, valid_to):
+        if not row_ok:
+            results.append(parse_date(date_str, current_year))
+            continue
+        if row_has_year:
+            from_year = f"{date_from // 10000:04d}"
+            to_year = f"{date_to // 10000:04d}"
+        else:
+            from_year = to_year = current_year
+        results.append((f"{from_year}-{date_from // 100 % 100:02d}-{date_from % 100:02d}",
+                        f"{to_year}-{date_to // 100 % 100:02d}-{date_to % 100:02d}"))
+    return results
+
+def _dump_record(record: Dict[str, Any]) -> bytes:
+    """Serializacia jedneho zaznamu odsadeneho ako prvok JSON pola"""
+    if orjson is not None:
+        data = orjson.dumps(record, option=orjson.OPT_INDENT_2)
+    else:
+        data = json.dumps(record, ensure_ascii=False, indent=2).encode('utf-8')
+    return data.replace(b"\n", b"\n  ")
+
+def extract_brochure_data(brochure: etree._Element, shop_name: str,
+                          base_url: str) -> Optional[Tuple[str, str, str]]:
+    """Extrahovanie dat z letaku
+    
+    Args:
+        brochure: lxml element platneho letaku
+        shop_name: Nazov obchodu
+        base_url: Zaklad pre relativne URL obrazkov
+        
+    Returns:
+        Tuple (title, thumbnail, text s datumami) alebo None v pripade chyby
+    """
+    try:
+        # Jeden prechod podstromom letaku, zapamatame si prvy vyskyt kazdej casti
+        title_node = lazy_img = first_img = date_element = date_alt_element = None
+        for node in brochure.iter("strong", "img", "small"):
+            if node.tag == "strong":
+                if title_node is None:
+                    title_node = node
+                continue
+            classes = (node.get("class") or "").split()
+            if node.tag == "img":
+                if first_img is None:
+                    first_img = node
+                if lazy_img is None and "lazyloadBrochure" in classes:
+                    lazy_img = node
+            elif date_element is None and "visible-sm" in classes:
+                date_element = node
+            elif date_alt_element is None and "hidden-sm" in classes:
+                date_alt_element = node
+        
+        # Ziskanie nadpisu letaku, prazdny nadpis sa ponechava
+        if title_node is None:
+            _logger.warning("Chyba nadpis letaku pre obchod %s", shop_name)
+            return None
+        title = "".join(title_node.itertext()).strip()
+        
+        # Ziskanie obrazku letaku - upravena metoda pre lazy loading
+        thumbnail = lazy_img.get("data-src") if lazy_img is not None else None
+        if not thumbnail:
+            # Skusime alternativne metody
+            if first_img is None:
+                _logger.warning("Chyba thumbnail letaku pre obchod %s", shop_name)
+                return None
+            
+            # Skusime src alebo data-src
+            thumbnail = first_img.get("src") or first_img.get("data-src")
+            if not thumbnail:
+                _logger.warning("Chyba URL thumbnailov pre obchod %s", shop_name)
+                return None
+        
+        # Ak URL nie je absolutna, doplnime base_url
+        if not thumbnail.startswith(('http://', 'https://')):
+            thumbnail = urljoin(base_url, thumbnail)
+        
+        # Ziskanie datumov platnosti
+        if date_element is None:
+            # Skusime alternativne triedy
+            date_element = date_alt_element
+            if date_element is None:
+                _logger.warning("Chybaju datumy platnosti letaku pre obchod %s", shop_name)
+                return None
+        
+        return title, thumbnail, "".join(date_element.itertext()).strip()
+    except Exception as e:
+        _logger.error("Chyba pri extrakcii dat letaku pre obchod %s: %s", shop_name, e)
+        return None
+
+def _parse_shop(content: bytes, shop_name: str, base_url: str,
+                parsed_time: str, current_year: str) -> List[Dict[str, Any]]:
+    """Parsovanie stranky obchodu, spustitelne aj v samostatnom procese
+    
+    Args:
+        content: Obsah stranky obchodu v bajtoch
+        shop_name: Nazov obchodu
+        base_url: Zaklad pre relativne URL obrazkov
+        parsed_time: Cas behu scrapera
+        current_year: Rok pre datumy bez roku
+        
+    Returns:
+        Zoznam slovnikov s datami letakov
+    """
+    brochures = []
+    
+    # Hladame platne brochures, stranka sa parsuje postupne
+    found = 0
+    extracted = []
+    for brochure in _iter_brochures(content):
+        found += 1
+        fields = extract_brochure_data(brochure, shop_name, base_url)
+        if fields:
+            extracted.append(fields)
+        else:
+            _logger.warning("Nepodarilo sa extrahovat data z letaku pre obchod %s", shop_name)
+    
+    # Datumy celej stranky sa parsuju naraz
+    dates = parse_dates([date_text for _, _, date_text in extracted], current_year)
+    for (title, thumbnail, _), (valid_from, valid_to) in zip(extracted, dates):
+        if not valid_from or not valid_to:
+            _logger.warning("Nepodarilo sa extrahovat data z letaku pre obchod %s", shop_name)
+            continue
+        
+        # Vytvorenie slovnika s datami letaku
+        brochures.append({
+            "title": title,
+            "thumbnail": thumbnail,
+            "shop_name": shop_name,
+            "valid_from": valid_from,
+            "valid_to": valid_to,
+            "parsed_time": parsed_time
+        })
+        _logger.info("Extrahovany letakovy data pre %s: %s (%s - %s)", 
+                     shop_name, title, valid_from, valid_to)
+    
+    _logger.info("Najdenych %d letakov pre obchod %s", found, shop_name)
+    return brochures
+
+def _init_parse_worker(log_queue: multiprocessing.Queue) -> None:
+    """Presmerovanie logovania procesu na parsovanie do hlavneho procesu
+    
+    Args:
+        log_queue: Fronta, z ktorej zaznamy zapisuju handlery hlavneho procesu
+    """
+    root = logging.getLogger()
+    # Pri fork su zdedene handlery hlavneho procesu, tie nahradime frontou
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(logging.INFO)
 
 class ProspektMaschinenScraper:
     """Trieda na ziskanie letakov z webu prospektmaschine.de"""
 
     BASE_URL = "https://www.prospektmaschine.de"
     HYPERMARKETS_PATH = "/hypermarkte/"
+    MIN_REQUEST_INTERVAL = 0.1
+    CACHE_EXPIRE_AFTER = 3600
     
-    def __init__(self, output_file: str = "brochures.json"):
+    def __init__(self, output_file: str = "brochures.json", max_workers: int = 8,
+                 parse_workers: Optional[int] = None,
+                 cache_name: Optional[str] = "prospekt_cache",
+                 page_cache_file: Optional[str] = "prospekt_pages.sqlite"):
         """Inicializacia scrapera
         
         Args:
             output_file: Nazov vystupneho suboru
+            max_workers: Maximalny pocet subezne stahovanych obchodov
+            parse_workers: Pocet procesov na parsovanie stranok (predvolene pocet jadier)
+            cache_name: Nazov SQLite cache odpovedi, None vypne cache
+            page_cache_file: SQLite subor s validatormi a letakmi stranok obchodov
+                z predoslych behov, None ho vypne
         """
         self.output_file = output_file
-        self.session = requests.Session()
-        self.headers = {
+        self.max_workers = max_workers
+        self.parse_workers = parse_workers or os.cpu_count()
+        self.page_cache_file = page_cache_file
+        self._http_cache = bool(cache_name)
+        self.reset_run_clock()
+        # Najskorsi povoleny zaciatok dalsej poziadavky pre kazdy host
+        self._next_allowed: Dict[str, float] = {}
+        self._rate_lock = threading.Lock()
+        if cache_name:
+            # Opakovane behy citaju nezmenene stranky z lokalnej cache
+            self.session = requests_cache.CachedSession(
+                cache_name,
+                backend='sqlite',
+                expire_after=self.CACHE_EXPIRE_AFTER,
+                allowable_methods=['GET'],
+                cache_control=True
+            )
+        else:
+            self.session = requests.Session()
+        # Znovupouzitie spojeni medzi vlaknami a opakovanie docasnych chyb
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=max(16, max_workers),
+            max_retries=Retry(total=3, backoff_factor=0.3,
+                              status_forcelist=[429, 500, 502, 503, 504])
+        )
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-            "Accept-Language": "en-US,en;q=0.9"
-        }
+            "Accept-Language": "en-US,en;q=0.9",
+            # gzip, deflate a br iba ak je dostupny dekoder pre brotli
+            "Accept-Encoding": make_headers(accept_encoding=True)["accept-encoding"]
+        })
         self.configure_logging()
+        # Zaznamy stranok sa citaju a zapisuju po jednom, v pamati su len
+        # validatory prave spracovavanych stranok a URL z aktualneho zoznamu
+        self._page_lock = threading.Lock()
+        self._page_db = self.open_page_cache()
+        self._page_validators: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+        self._seen_pages: set = set()
         
     def configure_logging(self) -> None:
         """Konfiguracia logovania"""
@@ -48,84 +516,150 @@ class ProspektMaschinenScraper:
             ]
         )
         self.logger = logging.getLogger(__name__)
+    
+    def reset_run_clock(self) -> None:
+        """Zaznamenanie casu behu, spolocneho pre vsetky letaky jedneho behu"""
+        now = datetime.datetime.now()
+        self._run_timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
+        self._current_year = str(now.year)
         
-    def get_page_content(self, url: str) -> Optional[BeautifulSoup]:
-        """Ziskanie obsahu stranky
+    def wait_for_request_slot(self, url: str) -> None:
+        """Dodrzanie minimalneho odstupu medzi zaciatkami poziadaviek na jeden host
+        
+        Kazde vlakno si pod zamkom rezervuje dalsi volny termin, takze cakaju
+        len poziadavky, ktore by prisli skor ako MIN_REQUEST_INTERVAL po predoslej.
+        
+        Args:
+            url: URL pripravovanej poziadavky
+        """
+        host = urlparse(url).netloc
+        with self._rate_lock:
+            now = time.monotonic()
+            slot = max(now, self._next_allowed.get(host, 0.0))
+            self._next_allowed[host] = slot + self.MIN_REQUEST_INTERVAL
+        if slot > now:
+            time.sleep(slot - now)
+    
+    def open_page_cache(self) -> Optional[sqlite3.Connection]:
+        """Otvorenie cache stranok obchodov z predoslych behov
+        
+        Returns:
+            Spojenie na SQLite subor alebo None, ak je cache vypnuta alebo nedostupna
+        """
+        if not self.page_cache_file:
+            return None
+        try:
+            # Spojenie pouzivaju aj vlakna na stahovanie, pristup chrani _page_lock
+            connection = sqlite3.connect(self.page_cache_file, check_same_thread=False)
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, brochures TEXT NOT NULL)"
+            )
+            return connection
+        except sqlite3.Error as e:
+            self.logger.warning("Nepodarilo sa otvorit cache stranok %s: %s", self.page_cache_file, e)
+            return None
+    
+    def load_page(self, url: str) -> Optional[Dict[str, Any]]:
+        """Nacitanie zaznamu stranky obchodu z cache stranok
+        
+        Args:
+            url: Plna URL stranky obchodu
+            
+        Returns:
+            Slovnik s etag, last_modified a brochures alebo None
+        """
+        if self._page_db is None:
+            return None
+        try:
+            with self._page_lock:
+                row = self._page_db.execute(
+                    "SELECT etag, last_modified, brochures FROM pages WHERE url = ?", (url,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            self.logger.warning("Chyba pri citani cache stranok pre %s: %s", url, e)
+            return None
+        if row is None:
+            return None
+        etag, last_modified, brochures = row
+        try:
+            brochures = json.loads(brochures)
+        except ValueError as e:
+            # Poskodeny zaznam berieme ako chybajuci, stranka sa stiahne nanovo
+            self.logger.warning("Neplatne letaky v cache stranok pre %s: %s", url, e)
+            return None
+        return {"etag": etag, "last_modified": last_modified, "brochures": brochures}
+    
+    def prune_page_cache(self) -> None:
+        """Odstranenie stranok obchodov, ktore uz nie su v zozname hypermarketov"""
+        if self._page_db is None or not self._seen_pages:
+            return
+        try:
+            with self._page_lock:
+                stale = [(url,) for url, in self._page_db.execute("SELECT url FROM pages")
+                         if url not in self._seen_pages]
+                self._page_db.executemany("DELETE FROM pages WHERE url = ?", stale)
+                self._page_db.commit()
+        except sqlite3.Error as e:
+            self.logger.error("Chyba pri cisteni cache stranok %s: %s", self.page_cache_file, e)
+    
+    def fetch_response(self, url: str,
+                       headers: Optional[Dict[str, str]] = None) -> Optional[requests.Response]:
+        """Stiahnutie stranky
         
         Args:
             url: URL stranky na ziskanie
+            headers: Dodatocne hlavicky poziadavky
             
         Returns:
-            BeautifulSoup objekt alebo None v pripade chyby
+            Odpoved servera alebo None v pripade chyby
         """
         try:
             self.logger.info("Nacitavam stranku: %s", url)
-            response = self.session.get(url, headers=self.headers)
+            if self._http_cache:
+                # Cerstva odpoved z lokalnej cache nejde na server, preto necaka na rad;
+                # 504 znamena, ze v cache nie je alebo je expirovana
+                response = self.session.get(url, headers=headers, only_if_cached=True)
+                if response.status_code != 504:
+                    response.raise_for_status()
+                    return response
+            self.wait_for_request_slot(url)
+            response = self.session.get(url, headers=headers)
             response.raise_for_status()
-            return BeautifulSoup(response.content, "html.parser")
+            return response
         except requests.exceptions.RequestException as e:
             self.logger.error("Chyba pri ziskavani stranky %s: %s", url, e)
             return None
     
-    def parse_date(self, date_str: str) -> tuple:
-        """Extrakcia datumov z textu
+    def fetch_page(self, url: str) -> Optional[bytes]:
+        """Stiahnutie suroveho obsahu stranky
         
         Args:
-            date_str: Retazec obsahujuci datumy
+            url: URL stranky na ziskanie
             
         Returns:
-            Tuple (valid_from, valid_to)
+            Obsah stranky v bajtoch alebo None v pripade chyby
         """
-        try:
-            # Rozdelenie textu na datumy
-            parts = date_str.strip().split('-')
-            
-            if len(parts) != 2:
-                self.logger.warning("Neocakavany format datumu: %s", date_str)
-                return None, None
-            
-            # Extrakcia a parsovanie datumov
-            date_from_str = parts[0].strip()
-            date_to_str = parts[1].strip()
-            
-            # Format datumov: DD.MM.YYYY alebo DD.MM.
-            date_pattern_full = r'(\d{2})\.(\d{2})\.(\d{4})'
-            date_pattern_short = r'(\d{2})\.(\d{2})\.'
-            
-            # Skusime najprv plny format
-            from_match_full = re.search(date_pattern_full, date_from_str)
-            to_match_full = re.search(date_pattern_full, date_to_str)
-            
-            if from_match_full and to_match_full:
-                from_day, from_month, from_year = from_match_full.groups()
-                to_day, to_month, to_year = to_match_full.groups()
-                valid_from = f"{from_year}-{from_month}-{from_day}"
-                valid_to = f"{to_year}-{to_month}-{to_day}"
-                return valid_from, valid_to
-            
-            # Ak plny format nefunguje, skusime kratky format
-            from_match_short = re.search(date_pattern_short, date_from_str)
-            to_match_short = re.search(date_pattern_short, date_to_str)
-            
-            if from_match_short and to_match_short:
-                from_day, from_month = from_match_short.groups()
-                to_day, to_month = to_match_short.groups()
-                # Predpokladame aktualny rok alebo hladame ho v texte
-                current_year = str(datetime.datetime.now().year)
-                
-                # Skusime najst rok v texte
-                year_match = re.search(r'(\d{4})', date_str)
-                year = year_match.group(1) if year_match else current_year
-                
-                valid_from = f"{year}-{from_month}-{from_day}"
-                valid_to = f"{year}-{to_month}-{to_day}"
-                return valid_from, valid_to
+        response = self.fetch_response(url)
+        if response is None:
+            return None
+        return response.content
+    
+    def get_page_content(self, url: str,
+                         parse_only: Optional[SoupStrainer] = None) -> Optional[BeautifulSoup]:
+        """Ziskanie obsahu stranky
+        
+        Args:
+            url: URL stranky na ziskanie
+            parse_only: Obmedzenie stromu len na vybrane elementy
             
-            self.logger.warning("Nepodarilo sa extrahovat datumy z: %s", date_str)
-            return None, None
-        except Exception as e:
-            self.logger.error("Chyba pri parsovani datumu %s: %s", date_str, e)
-            return None, None
+        Returns:
+            BeautifulSoup objekt alebo None v pripade chyby
+        """
+        content = self.fetch_page(url)
+        if content is None:
+            return None
+        return BeautifulSoup(content, "lxml", parse_only=parse_only)
     
     def get_hypermarket_links(self) -> List[Dict[str, str]]:
         """Ziskanie zoznamu hypermarketov
@@ -135,7 +669,8 @@ class ProspektMaschinenScraper:
         """
         hypermarkets = []
         
-        soup = self.get_page_content(urljoin(self.BASE_URL, self.HYPERMARKETS_PATH))
+        soup = self.get_page_content(urljoin(self.BASE_URL, self.HYPERMARKETS_PATH),
+                                     parse_only=_ONLY_CATEGORIES)
         if not soup:
             self.logger.error("Nepodarilo sa ziskat zoznam hypermarketov")
             return hypermarkets
@@ -145,83 +680,96 @@ class ProspektMaschinenScraper:
             self.logger.error("Nepodarilo sa najst kategorie na stranke")
             return hypermarkets
         
+        # Kazdy obchod staci stiahnut raz, aj ked je v zozname viackrat,
+        # porovnavame plne URL ako pri stahovani
+        seen = set()
         for link in categories.find_all("a"):
+            href = link.get("href")
+            if not href:
+                continue
+            full_url = urljoin(self.BASE_URL, href)
+            if full_url in seen:
+                continue
+            seen.add(full_url)
             hypermarkets.append({
-                "url": link.get("href"),
-                "name": link.text.strip()
+                "url": href,
+                "name": link.get_text(strip=True)
             })
         
         self.logger.info("Najdenych %d hypermarketov", len(hypermarkets))
         return hypermarkets
     
-    def extract_brochure_data(self, brochure, shop_name: str) -> Optional[Dict[str, Any]]:
-        """Extrahovanie dat z letaku
+    def fetch_shop_page(self, shop_url: str,
+                        shop_name: str) -> Tuple[Optional[bytes], Optional[List[Dict[str, Any]]]]:
+        """Stiahnutie stranky konkretneho obchodu
+        
+        Ak sa stranka od predosleho behu nezmenila (304 alebo rovnaky ETag,
+        pripadne Last-Modified), vratia sa letaky z predosleho parsovania.
         
         Args:
-            brochure: BeautifulSoup element letaku
+            shop_url: URL obchodu
             shop_name: Nazov obchodu
             
         Returns:
-            Slovnik s datami o letaku alebo None v pripade chyby
+            Tuple (obsah stranky, None) pre novu stranku, (None, letaky) pre
+            nezmenenu stranku alebo (None, None) v pripade chyby
         """
+        full_url = urljoin(self.BASE_URL, shop_url)
+        self.logger.info("Spracovavam obchod %s, URL: %s", shop_name, full_url)
+        
+        cached = self.load_page(full_url)
+        headers = {}
+        if cached and not self._http_cache:
+            # Bez HTTP cache posielame podmienene hlavicky sami
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+        
+        response = self.fetch_response(full_url, headers=headers)
+        if response is None:
+            self.logger.error("Nepodarilo sa ziskat stranku obchodu %s", shop_name)
+            return None, None
+        
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if cached and (response.status_code == 304
+                       or (etag and etag == cached.get("etag"))
+                       or (not etag and last_modified and last_modified == cached.get("last_modified"))):
+            self.logger.info("Stranka obchodu %s sa nezmenila, pouzivam predosle letaky", shop_name)
+            return None, [dict(brochure, parsed_time=self._run_timestamp)
+                          for brochure in cached["brochures"]]
+        
+        if not response.content:
+            self.logger.error("Nepodarilo sa ziskat stranku obchodu %s", shop_name)
+            return None, None
+        if self._page_db is not None and (etag or last_modified):
+            # Zaznam sa ulozi spolu s letakmi az po sparsovani stranky
+            self._page_validators[full_url] = (etag, last_modified)
+        return response.content, None
+    
+    def remember_shop_brochures(self, shop_url: str, brochures: List[Dict[str, Any]]) -> None:
+        """Zapamatanie letakov sparsovanej stranky obchodu pre dalsie behy
+        
+        Zaznam sa zapise hned, stranky bez ETag a Last-Modified sa neukladaju.
+        
+        Args:
+            shop_url: URL obchodu
+            brochures: Letaky zo stranky obchodu
+        """
+        full_url = urljoin(self.BASE_URL, shop_url)
+        validators = self._page_validators.pop(full_url, None)
+        if self._page_db is None or validators is None:
+            return
         try:
-            # Kontrola, ci je letak platny (nie je oznaceny ako stary)
-            if brochure.find("div", class_="grid-item-old"):
-                return None
-            
-            # Ziskanie nadpisu letaku
-            title_element = brochure.find("strong")
-            if not title_element:
-                self.logger.warning("Chyba nadpis letaku pre obchod %s", shop_name)
-                return None
-            title = title_element.text.strip()
-            
-            # Ziskanie obrazku letaku - upravena metoda pre lazy loading
-            img_element = brochure.find("img", class_="lazyloadBrochure")
-            if img_element and img_element.get("data-src"):
-                thumbnail = img_element.get("data-src")
-            else:
-                # Skusime alternativne metody
-                img_element = brochure.find("img")
-                if not img_element:
-                    self.logger.warning("Chyba thumbnail letaku pre obchod %s", shop_name)
-                    return None
-                
-                # Skusime src alebo data-src
-                thumbnail = img_element.get("src") or img_element.get("data-src")
-                if not thumbnail:
-                    self.logger.warning("Chyba URL thumbnailov pre obchod %s", shop_name)
-                    return None
-            
-            # Ak URL nie je absolutna, doplnime BASE_URL
-            if not thumbnail.startswith(('http://', 'https://')):
-                thumbnail = urljoin(self.BASE_URL, thumbnail)
-            
-            # Ziskanie datumov platnosti
-            date_element = brochure.find("small", class_="visible-sm")
-            if not date_element:
-                # Skusime alternativne triedy
-                date_element = brochure.find("small", class_="hidden-sm")
-                if not date_element:
-                    self.logger.warning("Chybaju datumy platnosti letaku pre obchod %s", shop_name)
-                    return None
-            
-            valid_from, valid_to = self.parse_date(date_element.text.strip())
-            if not valid_from or not valid_to:
-                return None
-            
-            # Vytvorenie slovnika s datami letaku
-            return {
-                "title": title,
-                "thumbnail": thumbnail,
-                "shop_name": shop_name,
-                "valid_from": valid_from,
-                "valid_to": valid_to,
-                "parsed_time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }
-        except Exception as e:
-            self.logger.error("Chyba pri extrakcii dat letaku pre obchod %s: %s", shop_name, e)
-            return None
+            with self._page_lock:
+                self._page_db.execute(
+                    "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)",
+                    (full_url, *validators, json.dumps(brochures, ensure_ascii=False))
+                )
+                self._page_db.commit()
+        except sqlite3.Error as e:
+            self.logger.error("Chyba pri ukladani cache stranok pre %s: %s", full_url, e)
     
     def get_brochures_for_shop(self, shop_url: str, shop_name: str) -> List[Dict[str, Any]]:
         """Ziskanie letakov pre konkretny obchod
@@ -233,30 +781,76 @@ class ProspektMaschinenScraper:
         Returns:
             Zoznam slovnikov s datami letakov
         """
-        brochures = []
+        content, brochures = self.fetch_shop_page(shop_url, shop_name)
+        if content:
+            brochures = _parse_shop(content, shop_name, self.BASE_URL,
+                                    self._run_timestamp, self._current_year)
+            self.remember_shop_brochures(shop_url, brochures)
+        return brochures or []
+    
+    def iter_shop_brochures(self) -> Iterator[List[Dict[str, Any]]]:
+        """Postupne ziskavanie letakov pre vsetky hypermarkety
         
-        full_url = urljoin(self.BASE_URL, shop_url)
-        self.logger.info("Spracovavam obchod %s, URL: %s", shop_name, full_url)
+        Obchody sa stahuju paralelne, najviac max_workers naraz, a ich stranky
+        sa parsuju v parse_workers procesoch.
         
-        soup = self.get_page_content(full_url)
-        if not soup:
-            self.logger.error("Nepodarilo sa ziskat stranku obchodu %s", shop_name)
-            return brochures
-        
-        # Hladame brochures
-        brochure_elements = soup.find_all("div", class_="brochure-thumb")
-        self.logger.info("Najdenych %d letakov pre obchod %s", len(brochure_elements), shop_name)
-        
-        for brochure in brochure_elements:
-            brochure_data = self.extract_brochure_data(brochure, shop_name)
-            if brochure_data:
-                brochures.append(brochure_data)
-                self.logger.info("Extrahovany letakovy data pre %s: %s (%s - %s)", 
-                               shop_name, brochure_data['title'], 
-                               brochure_data['valid_from'], brochure_data['valid_to'])
-            else:
-                self.logger.warning("Nepodarilo sa extrahovat data z letaku pre obchod %s", shop_name)
+        Yields:
+            Zoznam slovnikov s datami letakov jedneho obchodu, v poradi obchodov
+        """
+        hypermarkets = self.get_hypermarket_links()
+        self._seen_pages = {urljoin(self.BASE_URL, hypermarket['url']) for hypermarket in hypermarkets}
         
+        def fetch_shop(item):
+            i, hypermarket = item
+            self.logger.info("Spracovavam obchod %s (%d/%d)", 
+                           hypermarket['name'], i+1, len(hypermarkets))
+            content, brochures = self.fetch_shop_page(hypermarket['url'], hypermarket['name'])
+            return hypermarket, content, brochures
+        
+        # Vlakna stahuju stranky a procesy ich parsuju, parsovanie stiahnutej
+        # stranky zacne hned, ako je na rade; map zachovava poradie obchodov.
+        # Hotove obchody sa odovzdavaju priebezne, aby sa v pamati nehromadili.
+        # Nezmenene stranky sa neparsuju, ich letaky su hned k dispozicii.
+        # Logy procesov na parsovanie zapisuju handlery hlavneho procesu.
+        log_queue = multiprocessing.Queue()
+        listener = QueueListener(log_queue, *logging.getLogger().handlers,
+                                 respect_handler_level=True)
+        listener.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as fetch_pool, \
+                    ProcessPoolExecutor(max_workers=self.parse_workers,
+                                        initializer=_init_parse_worker,
+                                        initargs=(log_queue,)) as parse_pool:
+                # Polozky su (URL, Future parsovania) alebo (URL, znovupouzite letaky)
+                pending = deque()
+                for hypermarket, content, brochures in fetch_pool.map(fetch_shop, enumerate(hypermarkets)):
+                    if content:
+                        brochures = parse_pool.submit(_parse_shop, content, hypermarket['name'], self.BASE_URL,
+                                                      self._run_timestamp, self._current_year)
+                    elif brochures is None:
+                        continue
+                    pending.append((hypermarket['url'], brochures))
+                    while pending and (not isinstance(pending[0][1], Future) or pending[0][1].done()):
+                        yield self._finish_shop(*pending.popleft())
+                while pending:
+                    yield self._finish_shop(*pending.popleft())
+        finally:
+            listener.stop()
+    
+    def _finish_shop(self, shop_url: str,
+                     brochures: Any) -> List[Dict[str, Any]]:
+        """Prevzatie letakov obchodu zo spracovania a ich zapamatanie
+        
+        Args:
+            shop_url: URL obchodu
+            brochures: Future parsovania stranky alebo znovupouzite letaky
+            
+        Returns:
+            Zoznam slovnikov s datami letakov obchodu
+        """
+        if isinstance(brochures, Future):
+            brochures = brochures.result()
+            self.remember_shop_brochures(shop_url, brochures)
         return brochures
     
     def scrape_all_hypermarkets(self) -> List[Dict[str, Any]]:
@@ -266,40 +860,65 @@ class ProspektMaschinenScraper:
             Zoznam slovnikov s datami letakov pre vsetky obchody
         """
         all_brochures = []
-        hypermarkets = self.get_hypermarket_links()
-        
-        for i, hypermarket in enumerate(hypermarkets):
-            self.logger.info("Spracovavam obchod %s (%d/%d)", 
-                           hypermarket['name'], i+1, len(hypermarkets))
-            brochures = self.get_brochures_for_shop(hypermarket['url'], hypermarket['name'])
+        for brochures in self.iter_shop_brochures():
             all_brochures.extend(brochures)
-            
-            # Pridanie pauzy medzi poziadavkami
-            if i < len(hypermarkets) - 1:
-                time.sleep(1)
-        
         return all_brochures
     
-    def save_to_json(self, data: List[Dict[str, Any]]) -> None:
-        """Ulozenie dat do JSON suboru
+    def save_to_json_stream(self, batches: Iterable[List[Dict[str, Any]]]) -> int:
+        """Postupne ulozenie dat do JSON suboru
+        
+        Zaznamy sa zapisuju hned, ako prichadzaju, takze v pamati nie je cely
+        vystup naraz. Subor sa zapisuje vedla a premenuje sa az po dokonceni,
+        pri chybe sa rozpisany subor zmaze. Chyby pri ziskavani zaznamov
+        z batches sa neodchytavaju, logujeme len chyby zapisu.
         
         Args:
-            data: Data na ulozenie
+            batches: Postupnost zoznamov zaznamov na ulozenie
+            
+        Returns:
+            Pocet ulozenych zaznamov
         """
+        count = 0
+        tmp_file = f"{self.output_file}.tmp"
+        saved = False
         try:
-            with open(self.output_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            with open(tmp_file, 'wb') as f:
+                f.write(b"[")
+                for batch in batches:
+                    for record in batch:
+                        f.write(b",\n  " if count else b"\n  ")
+                        f.write(_dump_record(record))
+                        count += 1
+                f.write(b"\n]" if count else b"]")
+            os.replace(tmp_file, self.output_file)
+            saved = True
             self.logger.info("Data uspesne ulozene do suboru %s", self.output_file)
-        except Exception as e:
+        except OSError as e:
             self.logger.error("Chyba pri ukladani dat do suboru %s: %s", self.output_file, e)
+        finally:
+            if not saved:
+                try:
+                    os.remove(tmp_file)
+                except OSError:
+                    pass
+        return count
+    
+    def save_to_json(self, data: List[Dict[str, Any]]) -> None:
+        """Ulozenie dat do JSON suboru
+        
+        Args:
+            data: Data na ulozenie
+        """
+        self.save_to_json_stream([data])
     
     def run(self) -> None:
         """Spustenie scrapera"""
         self.logger.info("Spustam scraper pre prospektmaschine.de")
         start_time = time.time()
-        all_brochures = self.scrape_all_hypermarkets()
-        self.logger.info("Celkovo najdenych %d letakov", len(all_brochures))
-        self.save_to_json(all_brochures)
+        self.reset_run_clock()
+        total = self.save_to_json_stream(self.iter_shop_brochures())
+        self.logger.info("Celkovo najdenych %d letakov", total)
+        self.prune_page_cache()
         end_time = time.time()
         self.logger.info("Scraper uspesne dokonceny, trvanie: %.2f sekund", end_time - start_time)
 